@@ -11,11 +11,29 @@ import logging
 import sys
 import os
 import json
+import hmac
 from datetime import datetime
 import base64
-from ultralytics import YOLO
 import pyttsx3
-import socket
+
+# Load environment variables before importing our modules, which read
+# their settings (CAMERA_*, HAZARD_PROFILE, ...) at import time
+load_dotenv()
+
+from discovery import DiscoveryResponder, primary_ip
+from detection_history import (
+    get_history, find_history, list_sessions, rows_to_dicts, open_stream, close_stream, on_session_evicted,
+    clear_all as clear_all_histories
+)
+from camera_source import acquire_camera, release_camera, camera_health
+from frame_encoder import (
+    JpegEncoder, annotate_in_place, multipart_part, reconnecting_part, MULTIPART_BOUNDARY
+)
+from model_manager import ModelManager, DEFAULT_WEIGHTS
+from hazard_profiles import (
+    PROFILES, list_profiles, get_session_profile, set_session_profile, resolve_profile,
+    forget_session_profile
+)
 
 # Configure logging
 logging.basicConfig(
@@ -28,18 +46,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
 def get_local_ip():
     """Get the local IP address of the machine"""
     try:
-        # Create a socket connection to determine the local IP
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            # Connect to a remote address (doesn't have to be reachable)
-            s.connect(('8.8.8.8', 80))
-            local_ip = s.getsockname()[0]
-            return local_ip
+        return primary_ip()
     except Exception as e:
         logger.error(f"Error getting local IP: {e}")
         # Fallback to localhost
@@ -50,9 +60,10 @@ CORS(app, resources={
     r"/*": {
         "origins": "*",
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization", "X-Admin-Token"]
     }
 })
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
@@ -87,13 +98,26 @@ except Exception as e:
     logger.error(f"Error initializing Twilio client: {e}")
     twilio_client = None
     verified_numbers = DEFAULT_EMERGENCY_CONTACTS
+def on_model_names_change():
+    """History stores raw class IDs, which a new class table would mislabel"""
+    logger.warning("Model class table changed; clearing detection history")
+    clear_all_histories()
+
+model_manager = ModelManager(on_names_change=on_model_names_change)
 try:
-    model = YOLO('yolov5su.pt')
-    logger.info(f"YOLO model loaded successfully. Available classes: {model.names}")
+    model_manager.load(DEFAULT_WEIGHTS)
+    logger.info(f"YOLO model {DEFAULT_WEIGHTS} loaded successfully. Available classes: {model_manager.current().names}")
 except Exception as e:
     logger.error(f"Error loading YOLO model: {e}")
-    model = None
-latest_labels = "No objects detected"
+NO_OBJECTS = "No objects detected"
+latest_labels = {}  # session id -> labels from the most recent frame
+
+def forget_session(session_id):
+    """Drop per-session state when the history registry evicts a session"""
+    latest_labels.pop(session_id, None)
+    forget_session_profile(session_id)
+
+on_session_evicted(forget_session)
 is_tts_enabled = True
 engine = pyttsx3.init()
 engine.setProperty('rate', 150)
@@ -184,6 +208,9 @@ CAUTIONS = {
 }
 last_spoken = {}
 SPEAK_COOLDOWN = 3
+DEFAULT_SESSION = 'default'
+SOS_CONTEXT_WINDOW = 60  # seconds of detection history attached to SOS alerts
+STREAM_STALL_TIMEOUT = 30  # seconds without camera frames before a stream ends
 
 def speak_caution(text):
     """Speak the caution message using TTS"""
@@ -203,70 +230,109 @@ def should_speak_caution(label):
         return True
     return False
 
-def generate_frames():
+def generate_frames(session_id=DEFAULT_SESSION):
     """Generate frames from the webcam with object detection"""
-    global latest_labels
-    cap = None
+    history = open_stream(session_id)
+    encoder = JpegEncoder()
+    frame = None  # reused frame buffer, allocated by the first read
+    seq = 0
+    last_frame_at = time.monotonic()
+    camera = acquire_camera()
     try:
-        cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-        if not cap.isOpened():
-            logger.warning("Failed to open webcam with DirectShow. Trying default backend.")
-            cap = cv2.VideoCapture(0)
-        
-        if not cap.isOpened():
-            raise RuntimeError("Could not open the webcam")
-        
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-        cap.set(cv2.CAP_PROP_FPS, 30)
-        
-        logger.info("Camera initialized successfully with resolution: 1280x720")
+        logger.info(f"Streaming to session {session_id}, JPEG encoder: {encoder.backend}")
         
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                logger.warning("Failed to grab frame. Retrying...")
+            # Blocks until the grab thread has a newer frame, so a lost camera
+            # waits on reconnect instead of spinning
+            seq, new_frame = camera.read(frame, seq)
+            if new_frame is None:
+                if time.monotonic() - last_frame_at > STREAM_STALL_TIMEOUT:
+                    logger.warning(f"No camera frames for {STREAM_STALL_TIMEOUT}s; ending stream for session {session_id}")
+                    break
+                # Keep writing during an outage so a viewer that leaves is
+                # noticed and its camera reference released
+                yield reconnecting_part()
                 continue
+            frame = new_frame
+            last_frame_at = time.monotonic()
             
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
+            # Read once per frame so a hot swap never lands mid-frame
+            model = model_manager.current()
             if model:
-                results = model(frame_rgb)
-                detected_labels = []
+                profile = resolve_profile(get_session_profile(session_id), model.names)
+                # The annotated frame is drawn in place, so the shadow needs its own copy
+                shadow_frame = frame.copy() if model_manager.wants_shadow_sample() else None
+                try:
+                    started = time.perf_counter()
+                    # Restricting classes here lets NMS skip everything outside the profile.
+                    # The frame stays BGR: the model's preprocessing does the RGB swap itself.
+                    results = model(frame, classes=profile.class_ids,
+                                    conf=profile.min_threshold, verbose=False)
+                    latency = time.perf_counter() - started
+                except Exception as e:
+                    # Still stream the raw frame: writing is how werkzeug
+                    # notices a viewer that has gone away
+                    logger.error(f"Inference failed: {e}")
+                    model_manager.frame_done(model, error=e)
+                else:
+                    model_manager.frame_done(model)
+                    frame_time = time.time()
+                    detected_labels = []
+                    shadow_labels, shadow_boxes = [], np.zeros((0, 4), dtype=np.float32)
                 
-                for r in results:
-                    boxes = r.boxes
-                    for box in boxes:
-                        confidence = float(box.conf[0])
-                        if confidence >= 0.3:
-                            class_id = int(box.cls[0])
-                            label = model.names[class_id].lower()
+                    for r in results:
+                        boxes = r.boxes
+                        if not len(boxes):
+                            continue
+                        class_ids = boxes.cls.cpu().numpy().astype(np.intp)
+                        confs = boxes.conf.cpu().numpy()
+                        keep = profile.accept_mask(class_ids, confs)
+                        class_ids, confs = class_ids[keep], confs[keep]
+                        xyxy = boxes.xyxy.cpu().numpy()[keep]
+                        # Keyed by camera frame so two streams on one session record it once
+                        history.record(frame_time, class_ids, confs, xyxy, frame_key=(camera.epoch, seq))
+                        if shadow_frame is not None:
+                            shadow_labels = [model.names[int(c)].lower() for c in class_ids]
+                            shadow_boxes = xyxy
+                        annotate_in_place(frame, xyxy, class_ids, confs, model.names)
+                        for class_id in class_ids:
+                            label = model.names[int(class_id)].lower()
                             if label not in detected_labels:
                                 detected_labels.append(label)
                                 logger.debug(f"Detected {label}")
 
-                if detected_labels:
-                    latest_labels = detected_labels
-                    logger.debug(f"Detected labels: {latest_labels}")
-                else:
-                    latest_labels = "No objects detected"
+                    if detected_labels:
+                        latest_labels[session_id] = profile.sort_labels(detected_labels)
+                        logger.debug(f"Detected labels: {latest_labels[session_id]}")
+                    else:
+                        latest_labels[session_id] = NO_OBJECTS
 
-                annotated_frame = results[0].plot()
-            else:
-                annotated_frame = frame
+                    if shadow_frame is not None:
+                        model_manager.submit_shadow(shadow_frame, profile.name, shadow_labels, shadow_boxes, latency)
 
-            _, buffer = cv2.imencode('.jpg', annotated_frame)
-            frame_bytes = buffer.tobytes()
+            jpeg = encoder.encode(frame)
+            if jpeg is None:
+                logger.warning("Failed to encode frame. Skipping...")
+                continue
             
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            yield multipart_part(jpeg)
 
     except Exception as e:
         logger.error(f"Error in generate_frames: {e}")
     finally:
-        if cap:
-            cap.release()
-        logger.info("Camera released")
+        release_camera()
+        close_stream(session_id)
+
+def summarize_recent_detections(session_id=DEFAULT_SESSION, window=SOS_CONTEXT_WINDOW):
+    """Count detections per label over the last `window` seconds"""
+    history = find_history(session_id)
+    model = model_manager.current()
+    if history is None or not model:
+        return {}
+    rows = history.query(since=time.time() - window)
+    class_ids, counts = np.unique(rows['class_id'], return_counts=True)
+    summary = {model.names[int(c)].lower(): int(n) for c, n in zip(class_ids, counts)}
+    return dict(sorted(summary.items(), key=lambda item: item[1], reverse=True))
 
 @app.route('/')
 def index():
@@ -301,6 +367,11 @@ def trigger_sos():
             message = "🚨 EMERGENCY ALERT: Your friend needs help! (Location not available)"
             location_available = False
 
+        session_id = (data or {}).get('session', DEFAULT_SESSION)
+        recent_detections = summarize_recent_detections(session_id)
+        if recent_detections:
+            message += f" Recently seen nearby: {', '.join(list(recent_detections)[:5])}"
+
         successful_contacts = []
         failed_contacts = []
 
@@ -357,7 +428,8 @@ def trigger_sos():
                 "status": "ok",
                 "message": f"Emergency alert sent successfully to {len(successful_contacts)} contacts",
                 "successful_contacts": successful_contacts,
-                "failed_contacts": failed_contacts
+                "failed_contacts": failed_contacts,
+                "recent_detections": recent_detections
             })
         else:
             return jsonify({
@@ -386,20 +458,33 @@ def control_tts():
 @app.route('/video_feed')
 def video_feed():
     """Stream video feed with object detection"""
-    return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+    session_id = request.args.get('session', DEFAULT_SESSION)
+    return Response(generate_frames(session_id),
+                    mimetype=f"multipart/x-mixed-replace; boundary={MULTIPART_BOUNDARY.decode()}")
+
+@app.route('/api/camera/health', methods=['GET'])
+def get_camera_health():
+    """Report camera connection state, frame rate and reconnect count"""
+    return jsonify({"status": "ok", "camera": camera_health()})
 
 @app.route('/get_labels')
 def get_labels():
     """Get the latest detected labels and their cautions"""
     try:
-        logger.debug(f"Raw latest_labels: {latest_labels}")
+        session_id = request.args.get('session', DEFAULT_SESSION)
+        labels = latest_labels.get(session_id, NO_OBJECTS)
+        logger.debug(f"Raw latest_labels for {session_id}: {labels}")
         
-        if latest_labels == "No objects detected":
-            return jsonify({"labels": latest_labels, "cautions": "All clear"})
+        if labels == NO_OBJECTS:
+            return jsonify({"labels": labels, "cautions": "All clear"})
         
+        model = model_manager.current()
+        profile = resolve_profile(get_session_profile(session_id), model.names) if model else None
         detected_cautions = []
-        for label in latest_labels:
+        for label in labels:
+            # Only the active profile's non-quiet classes are eligible for speech
+            if profile and not profile.can_speak(label):
+                continue
             if label in CAUTIONS:
                 caution = CAUTIONS[label]
                 logger.debug(f"Found caution for {label}: {caution}")
@@ -408,8 +493,9 @@ def get_labels():
         cautions_text = ". ".join(detected_cautions) if detected_cautions else "Objects detected but no specific cautions available"
         
         response_data = {
-            "labels": ", ".join(latest_labels) if isinstance(latest_labels, list) else latest_labels,
-            "cautions": cautions_text
+            "labels": ", ".join(labels) if isinstance(labels, list) else labels,
+            "cautions": cautions_text,
+            "profile": profile.name if profile else get_session_profile(session_id)
         }
         logger.debug(f"Sending response: {response_data}")
         return jsonify(response_data)
@@ -419,6 +505,167 @@ def get_labels():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/profiles', methods=['GET'])
+def get_profiles():
+    """List the available hazard profiles"""
+    return jsonify({"status": "ok", "profiles": list_profiles()})
+
+@app.route('/api/profile', methods=['GET', 'POST'])
+def session_profile():
+    """Get or switch the hazard profile for a session"""
+    try:
+        if request.method == 'GET':
+            session_id = request.args.get('session', DEFAULT_SESSION)
+            return jsonify({"status": "ok", "session": session_id, "profile": get_session_profile(session_id)})
+
+        data = request.get_json() or {}
+        session_id = data.get('session', DEFAULT_SESSION)
+        name = str(data.get('profile', '')).strip().lower()
+        if name not in PROFILES:
+            return jsonify({"error": f"Unknown profile: {name}", "profiles": list(PROFILES)}), 400
+
+        # Registers the session so its profile is bounded by the same LRU
+        get_history(session_id)
+        set_session_profile(session_id, name)
+        latest_labels.pop(session_id, None)
+        logger.info(f"Session {session_id} switched to hazard profile '{name}'")
+        return jsonify({"status": "ok", "session": session_id, "profile": name})
+    except Exception as e:
+        logger.error(f"Error in session_profile: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/detections', methods=['GET'])
+def get_detections():
+    """Query detection history by time range and class.
+
+    `since`/`until` are epoch seconds; negative values are relative to now,
+    so `since=-60` returns the last minute. `class` takes a label or class ID.
+    """
+    try:
+        session_id = request.args.get('session', DEFAULT_SESSION)
+        now = time.time()
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+        if since is not None and since < 0:
+            since = now + since
+        if until is not None and until < 0:
+            until = now + until
+
+        model = model_manager.current()
+        class_id = None
+        class_arg = request.args.get('class')
+        if class_arg:
+            if class_arg.isdigit():
+                class_id = int(class_arg)
+            elif model:
+                ids = [i for i, name in model.names.items() if name.lower() == class_arg.lower()]
+                if not ids:
+                    return jsonify({"error": f"Unknown class: {class_arg}"}), 400
+                class_id = ids[0]
+            else:
+                return jsonify({"error": "Model not loaded - use a numeric class ID"}), 400
+
+        history = find_history(session_id)
+        if history is None:
+            return jsonify({"error": f"Unknown session: {session_id}", "sessions": list_sessions()}), 404
+
+        rows = history.query(since=since, until=until, class_id=class_id)
+        return jsonify({
+            "status": "ok",
+            "session": session_id,
+            "count": len(rows),
+            "detections": rows_to_dicts(rows, model.names if model else None)
+        })
+    except Exception as e:
+        logger.error(f"Error in get_detections: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def admin_denied():
+    """Return an error response unless the request carries ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        # Admin routes can swap the model on a safety device, so never serve them open
+        return jsonify({"error": "Admin API disabled - set ADMIN_TOKEN in .env"}), 503
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({"error": "Admin token required"}), 403
+    return None
+
+@app.route('/api/admin/model', methods=['GET', 'POST'])
+def admin_model():
+    """Show the live model, or load new weights in the background and swap them in"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if request.method == 'GET':
+        return jsonify({"status": "ok", "model": model_manager.status()})
+    try:
+        weights = (request.get_json() or {}).get('weights')
+        if not weights:
+            return jsonify({"error": "weights is required"}), 400
+        model_manager.swap_async(weights)
+        logger.info(f"Loading model {weights} for hot swap")
+        return jsonify({"status": "loading", "model": model_manager.status()}), 202
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.error(f"Error in admin_model: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/model/rollback', methods=['POST'])
+def admin_model_rollback():
+    """Reinstate the model that was live before the last swap"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if not model_manager.rollback(reason="manual rollback"):
+        return jsonify({"error": "No previous model to roll back to"}), 409
+    return jsonify({"status": "ok", "model": model_manager.status()})
+
+@app.route('/api/admin/model/shadow', methods=['GET', 'POST', 'DELETE'])
+def admin_model_shadow():
+    """Run a candidate model on sampled frames and compare it with the live one"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        if request.method == 'GET':
+            return jsonify({"status": "ok", "current": model_manager.weights, "shadow": model_manager.shadow_stats()})
+
+        if request.method == 'DELETE':
+            shadow = model_manager.stop_shadow()
+            if shadow is None:
+                return jsonify({"error": "No shadow model running"}), 404
+            return jsonify({"status": "ok", "shadow": shadow.stats()})
+
+        data = request.get_json() or {}
+        weights = data.get('weights')
+        if not weights:
+            return jsonify({"error": "weights is required"}), 400
+        sample_rate = float(data.get('sample_rate', 0.1))
+        if not 0 < sample_rate <= 1:
+            return jsonify({"error": "sample_rate must be in (0, 1]"}), 400
+        model_manager.start_shadow(weights, sample_rate)
+        return jsonify({"status": "loading", "model": model_manager.status()}), 202
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.error(f"Error in admin_model_shadow: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/model/shadow/promote', methods=['POST'])
+def admin_model_promote():
+    """Swap the shadow candidate in as the live model"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    shadow = model_manager.promote_shadow()
+    if shadow is None:
+        return jsonify({"error": "No shadow model running"}), 404
+    return jsonify({"status": "ok", "shadow": shadow.stats(), "model": model_manager.status()})
+
 @app.route('/api/emergency-contacts', methods=['GET'])
 def get_emergency_contacts():
     """Get list of current emergency contacts"""
@@ -436,7 +683,7 @@ def get_emergency_contacts():
 def after_request(response):
     """Add CORS headers to all responses"""
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Admin-Token')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
@@ -444,9 +691,13 @@ if __name__ == '__main__':
     try:
         local_ip = get_local_ip()
         port = 5000
+        debug = True
+        # With the debug reloader, only the serving child process should answer
+        if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            DiscoveryResponder(port, ready=lambda: model_manager.current() is not None).start()
         logger.info(f"Starting server on http://{local_ip}:{port}")
         logger.info(f"Server accessible at: http://{local_ip}:{port}")
         logger.info("Make sure your mobile device is on the same network!")
-        app.run(host='0.0.0.0', port=port, debug=True, threaded=True)
+        app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
     except Exception as e:
         logger.error(f"Error starting server: {e}")
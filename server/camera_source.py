@@ -0,0 +1,266 @@
+import logging
+import os
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CAMERA_INDICES = [int(i) for i in os.getenv('CAMERA_INDICES', '0').split(',') if i.strip()]
+CAMERA_WIDTH = int(os.getenv('CAMERA_WIDTH', '1280'))
+CAMERA_HEIGHT = int(os.getenv('CAMERA_HEIGHT', '720'))
+CAMERA_FPS = int(os.getenv('CAMERA_FPS', '30'))
+# Keep the driver queue as short as possible so we never serve stale frames
+CAMERA_BUFFER_SIZE = int(os.getenv('CAMERA_BUFFER_SIZE', '1'))
+
+MAX_GRAB_FAILURES = 30     # consecutive failed grabs before reconnecting
+GRAB_RETRY_DELAY = 0.01    # seconds between failed grabs
+BACKOFF_INITIAL = 0.5      # seconds
+BACKOFF_MAX = 30.0
+
+STATE_STOPPED = 'stopped'
+STATE_CONNECTING = 'connecting'
+STATE_OK = 'ok'
+STATE_RECONNECTING = 'reconnecting'
+
+
+def platform_backends():
+    """Preferred capture backends for this platform, best first"""
+    if sys.platform.startswith('win'):
+        return [cv2.CAP_DSHOW, cv2.CAP_MSMF, cv2.CAP_ANY]
+    if sys.platform.startswith('linux'):
+        return [cv2.CAP_V4L2, cv2.CAP_ANY]
+    if sys.platform == 'darwin':
+        return [cv2.CAP_AVFOUNDATION, cv2.CAP_ANY]
+    return [cv2.CAP_ANY]
+
+
+class CameraSource:
+    """Camera with a dedicated grab thread and reconnect/backoff.
+
+    The grab thread calls grab() continuously to keep the driver queue
+    drained, but only retrieves (decodes) a frame when a consumer is waiting
+    for one, so frames nobody asked for are never decoded.
+    """
+
+    def __init__(self, indices=None, width=CAMERA_WIDTH, height=CAMERA_HEIGHT,
+                 fps=CAMERA_FPS, buffer_size=CAMERA_BUFFER_SIZE):
+        self.indices = indices or CAMERA_INDICES
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.buffer_size = buffer_size
+
+        self._cap = None  # only touched by the grab thread once started
+        self._new_frame = threading.Condition()
+        self._wanted = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._exiting = False  # grab thread has seen _stop and is on its way out
+
+        # Double buffer: the grab thread decodes into _back, then swaps
+        self._seq = 0  # incremented on every decoded frame
+        self._front = None
+        self._back = None
+        self.epoch = 0  # bumped on every start so (epoch, seq) identifies a frame
+
+        self.state = STATE_STOPPED
+        self.device_index = None
+        self.backend = None
+        self.last_error = None
+        self.reconnects = 0
+        self._last_grab_time = 0.0
+        self._grab_fps = 0.0
+
+    def start(self):
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                if not self._exiting:
+                    # A previous stop() timed out while the thread was stuck in
+                    # the driver; it hasn't exited yet, so just keep it running
+                    self._stop.clear()
+                    return
+                self._thread.join()
+            self._stop.clear()
+            self._exiting = False
+            with self._new_frame:
+                # Don't hand a new stream a stale frame from the last session
+                self._seq = 0
+                self._front = None
+                self._back = None
+                self._wanted.clear()
+                self.epoch += 1
+            self.state = STATE_CONNECTING
+            self._thread = threading.Thread(target=self._run, name='camera-grab', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Ask the grab thread to exit; it releases the capture itself"""
+        self._stop.set()
+        with self._new_frame:
+            self._new_frame.notify_all()
+        thread = self._thread
+        if thread:
+            thread.join(timeout=2)
+            if thread.is_alive():
+                logger.warning("Camera grab thread is blocked in the driver; it will release the camera when it returns")
+
+    def _open(self):
+        # Repeated reopen attempts while reconnecting only log at debug level
+        log = logger.debug if self.state == STATE_RECONNECTING else logger.info
+        for index in self.indices:
+            for backend in platform_backends():
+                cap = cv2.VideoCapture(index, backend)
+                if not cap.isOpened():
+                    cap.release()
+                    continue
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+                cap.set(cv2.CAP_PROP_FPS, self.fps)
+                self.device_index = index
+                self.backend = cap.getBackendName()
+                log(
+                    f"Camera {index} opened with {self.backend} at "
+                    f"{int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}"
+                )
+                return cap
+        return None
+
+    def _release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _run(self):
+        backoff = BACKOFF_INITIAL
+        failures = 0
+        while True:
+            with self._thread_lock:
+                if self._stop.is_set():
+                    self._exiting = True
+                    break
+            if self._cap is None:
+                self._cap = self._open()
+                if self._cap is None:
+                    self.last_error = f"Could not open camera (indices {self.indices})"
+                    if self.state != STATE_RECONNECTING:
+                        logger.warning(f"{self.last_error}. Retrying with backoff")
+                    self.state = STATE_RECONNECTING
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, BACKOFF_MAX)
+                    continue
+                failures = 0
+
+            ok = self._cap.grab()
+            decode = ok and self._wanted.is_set()
+            if decode:
+                ok, self._back = self._cap.retrieve(self._back)
+
+            if not ok:
+                failures += 1
+                if failures >= MAX_GRAB_FAILURES:
+                    # Some devices open fine but never deliver frames, so back
+                    # off here too instead of reopening straight away
+                    self.last_error = f"{failures} consecutive grab failures"
+                    if self.state != STATE_RECONNECTING:
+                        logger.warning(f"Camera {self.device_index}: {self.last_error}. Reconnecting")
+                    self.state = STATE_RECONNECTING
+                    self._release()
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, BACKOFF_MAX)
+                else:
+                    self._stop.wait(GRAB_RETRY_DELAY)
+                continue
+
+            # Only a delivered frame proves the camera is healthy
+            failures = 0
+            if self.state != STATE_OK:
+                if self.state == STATE_RECONNECTING:
+                    self.reconnects += 1
+                    logger.info("Camera reconnected")
+                self.state = STATE_OK
+                backoff = BACKOFF_INITIAL
+            now = time.monotonic()
+            if self._last_grab_time:
+                # Exponential moving average of the grab rate
+                self._grab_fps = 0.9 * self._grab_fps + 0.1 / max(now - self._last_grab_time, 1e-6)
+            self._last_grab_time = now
+            if decode:
+                with self._new_frame:
+                    self._front, self._back = self._back, self._front
+                    self._seq += 1
+                    self._wanted.clear()
+                    self._new_frame.notify_all()
+
+        self._release()
+        self.state = STATE_STOPPED
+        logger.info("Camera released")
+
+    def read(self, out=None, last_seq=0, timeout=1.0):
+        """Wait for a frame newer than last_seq and copy it into out.
+
+        Returns (seq, frame). frame is None if no new frame arrived within
+        timeout, e.g. while the camera is reconnecting.
+        """
+        with self._new_frame:
+            if self._seq <= last_seq:
+                self._wanted.set()
+                ready = self._new_frame.wait_for(
+                    lambda: self._seq > last_seq or self._stop.is_set(), timeout)
+                if not ready or self._seq <= last_seq:
+                    return last_seq, None
+            frame = self._front
+            if out is None or out.shape != frame.shape:
+                out = np.empty_like(frame)
+            np.copyto(out, frame)
+            return self._seq, out
+
+    def health(self):
+        age = time.monotonic() - self._last_grab_time if self._last_grab_time else None
+        return {
+            "state": self.state,
+            "device_index": self.device_index,
+            "backend": self.backend,
+            "requested_resolution": f"{self.width}x{self.height}",
+            "grab_fps": round(self._grab_fps, 1),
+            "last_frame_age": round(age, 3) if age is not None else None,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+        }
+
+
+_source = None
+_clients = 0
+_source_lock = threading.Lock()
+
+
+def acquire_camera():
+    """Get the shared camera source, starting it for the first client"""
+    global _source, _clients
+    with _source_lock:
+        if _source is None:
+            _source = CameraSource()
+        if _clients == 0:
+            _source.start()
+        _clients += 1
+        return _source
+
+
+def release_camera():
+    """Drop a client, stopping the camera once nobody is streaming"""
+    global _clients
+    with _source_lock:
+        _clients = max(_clients - 1, 0)
+        if _clients == 0 and _source is not None:
+            _source.stop()
+
+
+def camera_health():
+    with _source_lock:
+        health = _source.health() if _source else {"state": STATE_STOPPED}
+        health["clients"] = _clients
+        return health
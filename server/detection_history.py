@@ -0,0 +1,206 @@
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# One row per detection. Fixed-size fields keep each record at 30 bytes so
+# the buffer's footprint is known up front and never grows.
+DETECTION_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('class_id', np.int16),
+    ('confidence', np.float32),
+    ('bbox', np.float32, (4,)),
+])
+
+DEFAULT_CAPACITY = 8192
+# Bounds the number of per-session buffers so total memory stays constant
+MAX_SESSIONS = 16
+
+
+class DetectionHistory:
+    """Fixed-capacity ring buffer of detections, ordered by timestamp"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=DETECTION_DTYPE)
+        self._head = 0  # next slot to write
+        self._size = 0
+        self._last_timestamp = float('-inf')
+        self._last_frame_key = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def record(self, timestamp, class_ids, confidences, bboxes, frame_key=None):
+        """Append all detections from one frame, overwriting the oldest rows.
+
+        frame_key identifies the camera frame; when several streams share a
+        session, only the first to report a given frame is recorded.
+        """
+        if frame_key is not None:
+            with self._lock:
+                if self._last_frame_key is not None and frame_key <= self._last_frame_key:
+                    return
+                self._last_frame_key = frame_key
+        class_ids = np.asarray(class_ids, dtype=np.int16).reshape(-1)
+        count = len(class_ids)
+        if count == 0:
+            return
+        confidences = np.asarray(confidences, dtype=np.float32).reshape(-1)
+        bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+
+        # A single frame larger than the buffer only keeps its tail
+        if count > self.capacity:
+            class_ids = class_ids[-self.capacity:]
+            confidences = confidences[-self.capacity:]
+            bboxes = bboxes[-self.capacity:]
+            count = self.capacity
+
+        with self._lock:
+            # Range queries bisect on timestamp, so never let it go backwards
+            timestamp = max(float(timestamp), self._last_timestamp)
+            self._last_timestamp = timestamp
+            idx = (self._head + np.arange(count)) % self.capacity
+            self._buffer['timestamp'][idx] = timestamp
+            self._buffer['class_id'][idx] = class_ids
+            self._buffer['confidence'][idx] = confidences
+            self._buffer['bbox'][idx] = bboxes
+            self._head = (self._head + count) % self.capacity
+            self._size = min(self._size + count, self.capacity)
+
+    def _segments(self):
+        """Return the stored rows as up to two chronological views"""
+        if self._size < self.capacity:
+            return [self._buffer[:self._size]]
+        return [self._buffer[self._head:], self._buffer[:self._head]]
+
+    def query(self, since=None, until=None, class_id=None):
+        """Return a copy of the detections with since <= timestamp <= until"""
+        with self._lock:
+            parts = []
+            for segment in self._segments():
+                # Each segment is sorted by timestamp, so bisect instead of scanning
+                times = segment['timestamp']
+                start = 0 if since is None else np.searchsorted(times, since, side='left')
+                stop = len(segment) if until is None else np.searchsorted(times, until, side='right')
+                if start < stop:
+                    parts.append(segment[start:stop])
+            rows = np.concatenate(parts) if parts else np.zeros(0, dtype=DETECTION_DTYPE)
+
+        if class_id is not None:
+            rows = rows[rows['class_id'] == class_id]
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._head = 0
+            self._size = 0
+            self._last_timestamp = float('-inf')
+            self._last_frame_key = None
+
+
+# Session registry, least recently used first. Other per-session state
+# (labels, profiles) registers a callback so it is dropped on eviction too.
+_histories = OrderedDict()
+_active_streams = {}
+_eviction_callbacks = []
+_histories_lock = threading.Lock()
+
+
+def on_session_evicted(callback):
+    """Register callback(session_id), called when a session is evicted"""
+    _eviction_callbacks.append(callback)
+
+
+def _evict_locked():
+    """Drop the least recently used session without an active stream"""
+    for session_id in _histories:
+        if not _active_streams.get(session_id):
+            del _histories[session_id]
+            return session_id
+    # Every session is streaming; growth is bounded by live connections
+    logger.warning(f"All {len(_histories)} sessions have active streams; not evicting")
+    return None
+
+
+def get_history(session_id, capacity=DEFAULT_CAPACITY, stream=False):
+    """Get (or create) the detection history for a camera/session.
+
+    With stream=True the session is also marked as streaming, so it can't
+    be evicted until close_stream() is called.
+    """
+    evicted = None
+    with _histories_lock:
+        if stream:
+            _active_streams[session_id] = _active_streams.get(session_id, 0) + 1
+        history = _histories.get(session_id)
+        if history is None:
+            if len(_histories) >= MAX_SESSIONS:
+                evicted = _evict_locked()
+            history = DetectionHistory(capacity)
+            _histories[session_id] = history
+        else:
+            _histories.move_to_end(session_id)
+    if evicted is not None:
+        logger.info(f"Evicted detection history for idle session {evicted}")
+        for callback in _eviction_callbacks:
+            callback(evicted)
+    return history
+
+
+def find_history(session_id):
+    """Return the history for a camera/session, or None if it has none"""
+    with _histories_lock:
+        history = _histories.get(session_id)
+        if history is not None:
+            _histories.move_to_end(session_id)
+        return history
+
+
+def open_stream(session_id):
+    """Mark a session as streaming (never evicted) and return its history"""
+    return get_history(session_id, stream=True)
+
+
+def close_stream(session_id):
+    with _histories_lock:
+        count = _active_streams.get(session_id, 0) - 1
+        if count > 0:
+            _active_streams[session_id] = count
+        else:
+            _active_streams.pop(session_id, None)
+
+
+def clear_all():
+    """Empty every session's history, keeping the sessions themselves"""
+    with _histories_lock:
+        histories = list(_histories.values())
+    for history in histories:
+        history.clear()
+
+
+def list_sessions():
+    with _histories_lock:
+        return list(_histories.keys())
+
+
+def rows_to_dicts(rows, names=None):
+    """Convert structured rows to JSON-serialisable dicts"""
+    detections = []
+    for row in rows:
+        class_id = int(row['class_id'])
+        detection = {
+            "timestamp": float(row['timestamp']),
+            "class_id": class_id,
+            "confidence": round(float(row['confidence']), 4),
+            "bbox": [round(float(v), 1) for v in row['bbox']],
+        }
+        if names is not None:
+            detection["label"] = names.get(class_id, str(class_id)) if isinstance(names, dict) else names[class_id]
+        detections.append(detection)
+    return detections
@@ -0,0 +1,242 @@
+import ipaddress
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_PORT = int(os.getenv('DISCOVERY_PORT', '5001'))
+DISCOVERY_GROUP = os.getenv('DISCOVERY_GROUP', '239.255.77.77')
+DISCOVERY_QUERY = b'BLIND_DISCOVER'
+SERVICE_NAME = 'blind'
+
+# Linux ioctls for reading an interface's IPv4 address and netmask
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+RTF_UP = 0x0001
+
+# Container bridges, hypervisor adapters and VPN tunnels; never the LAN a
+# phone on the same Wi-Fi can reach
+VIRTUAL_PREFIXES = (
+    'docker', 'br-', 'virbr', 'veth', 'vmnet', 'vboxnet', 'lxcbr', 'lxdbr', 'cni',
+    'flannel', 'tun', 'tap', 'wg', 'zt', 'tailscale', 'utun', 'vEthernet',
+)
+# Non-Linux only (see _routed_ip). Any routable address works; TEST-NET-1
+# (RFC 5737) is never a real host.
+ROUTE_PROBE_ADDRESS = ('192.0.2.1', 9)
+
+
+def _ioctl_ipv4(sock, request, name):
+    import fcntl
+    packed = struct.pack('256s', name.encode()[:15])
+    return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), request, packed)[20:24])
+
+
+def list_interfaces():
+    """List non-loopback IPv4 interfaces as dicts with interface, ip and netmask"""
+    interfaces = []
+    if sys.platform.startswith('linux'):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for _, name in socket.if_nameindex():
+                try:
+                    ip = _ioctl_ipv4(s, SIOCGIFADDR, name)
+                    netmask = _ioctl_ipv4(s, SIOCGIFNETMASK, name)
+                except OSError:
+                    continue  # interface is down or has no IPv4 address
+                if not ip.startswith('127.'):
+                    interfaces.append({'interface': name, 'ip': ip, 'netmask': netmask})
+    else:
+        # No per-interface ioctls here; the resolver still knows our addresses
+        try:
+            infos = socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)
+        except socket.gaierror:
+            infos = []
+        for ip in dict.fromkeys(info[4][0] for info in infos):
+            if not ip.startswith('127.'):
+                interfaces.append({'interface': None, 'ip': ip, 'netmask': None})
+    return interfaces
+
+
+def is_virtual(name):
+    return bool(name) and name.startswith(VIRTUAL_PREFIXES)
+
+
+def default_route_interface():
+    """Name of the interface carrying the IPv4 default route (Linux only)"""
+    best = None
+    try:
+        with open('/proc/net/route') as f:
+            next(f)  # header
+            for line in f:
+                fields = line.split()
+                if len(fields) < 7 or fields[1] != '00000000':
+                    continue
+                if not int(fields[3], 16) & RTF_UP:
+                    continue
+                metric = int(fields[6])
+                if best is None or metric < best[0]:
+                    best = (metric, fields[0])
+    except (OSError, ValueError, StopIteration):
+        return None
+    return best[1] if best else None
+
+
+def _routed_ip(destination=ROUTE_PROBE_ADDRESS):
+    """Source address the OS would use to reach destination.
+
+    Only used off Linux: the standard library has no interface or routing
+    table API on macOS/Windows, so this asks the kernel via connect() on a
+    UDP socket, which picks a route and sends nothing. Linux reads the
+    interfaces and /proc/net/route directly instead.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(destination)
+            ip = s.getsockname()[0]
+    except OSError:
+        return None
+    return None if ip.startswith(('127.', '0.')) else ip
+
+
+def primary_ip():
+    """Best guess at the LAN address.
+
+    Prefers the default-route interface, then any non-virtual private
+    address, so docker0/virbr0/VPN tunnels aren't picked over the real NIC.
+    Off Linux the default route comes from _routed_ip().
+    """
+    interfaces = list_interfaces()
+    if sys.platform.startswith('linux'):
+        route_iface = default_route_interface()
+        for interface in interfaces:
+            if interface['interface'] == route_iface and not is_virtual(route_iface):
+                return interface['ip']
+    else:
+        # getaddrinfo(gethostname()) is often loopback-only on macOS and lists
+        # Hyper-V/WSL adapters first on Windows, so ask the routing table
+        ip = _routed_ip()
+        if ip:
+            return ip
+    candidates = [i for i in interfaces if not is_virtual(i['interface'])] or interfaces
+    for interface in candidates:
+        if ipaddress.ip_address(interface['ip']).is_private:
+            return interface['ip']
+    return candidates[0]['ip'] if candidates else '127.0.0.1'
+
+
+def ip_for_peer(peer_ip):
+    """Pick the local address on the same network as peer_ip"""
+    if not sys.platform.startswith('linux'):
+        # No netmasks off Linux, so let the routing table pick
+        return _routed_ip((peer_ip, DISCOVERY_PORT)) or primary_ip()
+    peer = ipaddress.ip_address(peer_ip)
+    for interface in list_interfaces():
+        if interface['netmask']:
+            network = ipaddress.ip_network(f"{interface['ip']}/{interface['netmask']}", strict=False)
+            if peer in network:
+                return interface['ip']
+    return primary_ip()
+
+
+def is_lan_peer(peer_ip):
+    """True for private and link-local senders, the only ones we answer"""
+    try:
+        address = ipaddress.ip_address(peer_ip)
+    except ValueError:
+        return False
+    return address.is_private or address.is_link_local
+
+
+class DiscoveryResponder(threading.Thread):
+    """Answer LAN broadcast/multicast "where is the Blind server" queries"""
+
+    def __init__(self, http_port, ready=None, port=DISCOVERY_PORT, group=DISCOVERY_GROUP):
+        super().__init__(name='discovery', daemon=True)
+        self.http_port = http_port
+        self.ready = ready or (lambda: True)
+        self.port = port
+        self.group = group
+        self._stop_event = threading.Event()
+
+    def _bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', self.port))
+        try:
+            membership = struct.pack('4s4s', socket.inet_aton(self.group), socket.inet_aton('0.0.0.0'))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as e:
+            logger.warning(f"Discovery multicast unavailable, broadcast only: {e}")
+        sock.settimeout(1.0)
+        return sock
+
+    def describe(self, peer_ip):
+        ip = ip_for_peer(peer_ip)
+        return {
+            "service": SERVICE_NAME,
+            "url": f"http://{ip}:{self.http_port}",
+            "ip": ip,
+            "port": self.http_port,
+            "ready": bool(self.ready()),
+        }
+
+    def run(self):
+        try:
+            sock = self._bind()
+        except OSError as e:
+            logger.error(f"Could not start discovery responder on UDP {self.port}: {e}")
+            return
+        logger.info(f"Discovery responder listening on UDP {self.port} (group {self.group})")
+        with sock:
+            while not self._stop_event.is_set():
+                try:
+                    data, peer = sock.recvfrom(512)
+                except socket.timeout:
+                    continue
+                except OSError as e:
+                    logger.error(f"Discovery socket error: {e}")
+                    break
+                if data.strip() != DISCOVERY_QUERY:
+                    continue
+                # The reply is several times the query's size, so answering a
+                # spoofed public source would make us a reflection amplifier
+                if not is_lan_peer(peer[0]):
+                    logger.debug(f"Ignoring discovery query from non-LAN address {peer[0]}")
+                    continue
+                try:
+                    sock.sendto(json.dumps(self.describe(peer[0])).encode(), peer)
+                except OSError as e:
+                    logger.warning(f"Failed to answer discovery query from {peer[0]}: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def discover(timeout=1.0, port=DISCOVERY_PORT, group=DISCOVERY_GROUP):
+    """Query the LAN for Blind servers and return their replies"""
+    servers = {}
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.settimeout(timeout)
+        for address in ('255.255.255.255', group):
+            try:
+                sock.sendto(DISCOVERY_QUERY, (address, port))
+            except OSError:
+                pass
+        try:
+            while True:
+                data, peer = sock.recvfrom(1024)
+                try:
+                    reply = json.loads(data)
+                except ValueError:
+                    continue
+                if reply.get('service') == SERVICE_NAME:
+                    servers[reply['url']] = reply
+        except socket.timeout:
+            pass
+    return list(servers.values())
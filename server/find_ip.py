@@ -1,74 +1,14 @@
 #!/usr/bin/env python3
 
-import socket
-import subprocess
-import platform
-import re
+import argparse
 import os
+import re
+from dotenv import load_dotenv
 
-def get_local_ip():
-    """Get the local IP address of the machine"""
-    try:
-        # Create a socket connection to determine the local IP
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            # Connect to a remote address (doesn't have to be reachable)
-            s.connect(('8.8.8.8', 80))
-            local_ip = s.getsockname()[0]
-            return local_ip
-    except Exception as e:
-        print(f"Error getting local IP: {e}")
-        return None
+# DISCOVERY_PORT/GROUP may come from server/.env
+load_dotenv()
 
-def get_all_network_interfaces():
-    """Get all network interfaces and their IP addresses"""
-    interfaces = []
-    system = platform.system().lower()
-    
-    try:
-        if system == "windows":
-            # Use ipconfig on Windows
-            result = subprocess.run(['ipconfig'], capture_output=True, text=True)
-            output = result.stdout
-            
-            # Parse ipconfig output
-            current_interface = None
-            for line in output.split('\n'):
-                line = line.strip()
-                if 'adapter' in line.lower() and ':' in line:
-                    current_interface = line.split(':')[0].replace('adapter', '').strip()
-                elif 'IPv4 Address' in line and current_interface:
-                    ip_match = re.search(r'(\d+\.\d+\.\d+\.\d+)', line)
-                    if ip_match:
-                        ip = ip_match.group(1)
-                        if not ip.startswith('127.'):  # Skip loopback
-                            interfaces.append({
-                                'interface': current_interface,
-                                'ip': ip
-                            })
-        else:
-            # Use ifconfig on Unix-like systems
-            result = subprocess.run(['ifconfig'], capture_output=True, text=True)
-            output = result.stdout
-            
-            # Parse ifconfig output
-            current_interface = None
-            for line in output.split('\n'):
-                line = line.strip()
-                if line and not line.startswith(' '):
-                    current_interface = line.split(':')[0]
-                elif 'inet ' in line and current_interface:
-                    ip_match = re.search(r'inet (\d+\.\d+\.\d+\.\d+)', line)
-                    if ip_match:
-                        ip = ip_match.group(1)
-                        if not ip.startswith('127.'):  # Skip loopback
-                            interfaces.append({
-                                'interface': current_interface,
-                                'ip': ip
-                            })
-    except Exception as e:
-        print(f"Error getting network interfaces: {e}")
-    
-    return interfaces
+from discovery import list_interfaces, primary_ip, discover, DISCOVERY_PORT
 
 def update_client_env(ip_address):
     """Update the client's .env file with the new IP address"""
@@ -134,46 +74,46 @@ def update_client_config(ip_address):
         return False
 
 def main():
+    parser = argparse.ArgumentParser(description="Find this machine's LAN IP and write it into the client config")
+    parser.add_argument('--no-write', action='store_true',
+                        help="only list addresses and running servers; leave client/.env and client/config/api.js alone")
+    args = parser.parse_args()
+
     print("🔍 Finding local IP addresses...\n")
     
-    # Get the primary IP address
-    primary_ip = get_local_ip()
-    
-    # Get all network interfaces
-    interfaces = get_all_network_interfaces()
-    
-    if primary_ip:
-        print(f"🎯 Primary IP address: {primary_ip}")
+    interfaces = list_interfaces()
+    selected_ip = primary_ip() if interfaces else None
     
     if interfaces:
-        print("\n📡 All available network interfaces:")
+        print("📡 All available network interfaces:")
         for i, interface in enumerate(interfaces, 1):
-            print(f"{i}. {interface['interface']}: {interface['ip']}")
-    
-    # Use primary IP if available, otherwise use first interface
-    selected_ip = primary_ip
-    if not selected_ip and interfaces:
-        selected_ip = interfaces[0]['ip']
+            print(f"{i}. {interface['interface'] or 'host'}: {interface['ip']}")
     
     if not selected_ip:
         print("❌ No network interfaces found!")
         print("Make sure you are connected to a network.")
         return
     
-    print(f"\n🎯 Using IP address: {selected_ip}")
+    print(f"\n🎯 Primary IP address: {selected_ip}")
+
+    print(f"\n📣 Asking the LAN for running servers (UDP {DISCOVERY_PORT})...")
+    servers = discover()
+    if servers:
+        for server in servers:
+            state = "ready" if server.get('ready') else "starting"
+            print(f"✅ {server['url']} ({state})")
+    else:
+        print("⚠️ No server answered. Start it with: python app.py")
+
+    if args.no_write:
+        print("\n--no-write given; client configuration left unchanged.")
+        return
 
     # Update client configuration
     env_updated = update_client_env(selected_ip)
     config_updated = update_client_config(selected_ip)
 
-    if env_updated and config_updated:
-        print("\n📋 Next steps:")
-        print("1. Start the server: python app.py")
-        print("2. Make sure your mobile device is on the same network")
-        print("3. Start the client: cd ../client && expo start --clear")
-        print(f"4. Your server will be accessible at: http://{selected_ip}:5000")
-        print("\n🔄 Run this script again if you change networks!")
-    else:
+    if not (env_updated and config_updated):
         print(f"\n⚠️  Couldn't update client configuration automatically.")
         print(f"Please manually update the client/.env file with:")
         print(f"EXPO_PUBLIC_SERVER_URL=http://{selected_ip}:5000")
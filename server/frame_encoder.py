@@ -0,0 +1,107 @@
+import functools
+import inspect
+import logging
+import os
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = int(os.getenv('JPEG_QUALITY', '95'))
+
+# Multipart framing is constant, so it is built once at import
+MULTIPART_BOUNDARY = b'frame'
+PART_HEADER = b'--' + MULTIPART_BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n\r\n'
+PART_TRAILER = b'\r\n'
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    try:
+        _turbo = TurboJPEG()
+    except Exception as e:  # Python binding present but libturbojpeg missing
+        logger.warning(f"libjpeg-turbo unavailable, falling back to OpenCV encoder: {e}")
+        _turbo = None
+except ImportError:
+    _turbo = None
+
+# PyTurboJPEG >= 1.8.2 can compress into a caller-owned buffer
+_turbo_dst = bool(_turbo) and 'dst' in inspect.signature(_turbo.encode).parameters
+
+
+class JpegEncoder:
+    """Encode BGR frames to JPEG, preferring libjpeg-turbo when installed"""
+
+    def __init__(self, quality=JPEG_QUALITY):
+        self.quality = quality
+        self.backend = 'turbojpeg' if _turbo else 'opencv'
+        self._params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self._dst = None  # reused turbojpeg output buffer, sized for the frame
+        self._dst_shape = None
+
+    def encode(self, frame):
+        """Return the encoded JPEG as a bytes-like buffer, or None on failure.
+
+        With turbojpeg the result is a view into a buffer reused by the next
+        call, so it must be consumed (see multipart_part) before encoding
+        again. cv2.imencode has no output-buffer argument in the Python
+        binding, so the OpenCV fallback still allocates one array per frame.
+        """
+        if _turbo_dst:
+            if frame.shape != self._dst_shape:
+                # Worst-case size for this resolution, so libjpeg-turbo never reallocates
+                self._dst = bytearray(_turbo.buffer_size(frame, TJSAMP_420))
+                self._dst_shape = frame.shape
+            result, size = _turbo.encode(frame, quality=self.quality, pixel_format=TJPF_BGR,
+                                         jpeg_subsample=TJSAMP_420, dst=self._dst)
+            return memoryview(result)[:size]
+        if _turbo:
+            return _turbo.encode(frame, quality=self.quality,
+                                 pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420)
+        ok, buffer = cv2.imencode('.jpg', frame, self._params)
+        # No tobytes() here: multipart_part() copies the buffer exactly once
+        return buffer if ok else None
+
+
+# Small fixed palette (BGR) so each class keeps a stable box colour
+_PALETTE = [
+    (56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+    (10, 249, 72), (23, 204, 146), (134, 219, 61), (52, 147, 26), (187, 212, 0),
+    (168, 153, 44), (255, 194, 0), (147, 69, 52), (255, 115, 100), (236, 24, 0),
+    (255, 56, 132), (133, 0, 82), (255, 56, 203), (200, 149, 255), (199, 55, 255),
+]
+
+
+def annotate_in_place(frame, boxes, class_ids, confidences, names):
+    """Draw detections directly onto the capture frame (no full-frame copy)"""
+    for (x1, y1, x2, y2), class_id, confidence in zip(boxes, class_ids, confidences):
+        color = _PALETTE[int(class_id) % len(_PALETTE)]
+        p1, p2 = (int(x1), int(y1)), (int(x2), int(y2))
+        cv2.rectangle(frame, p1, p2, color, 2, cv2.LINE_AA)
+        text = f"{names[int(class_id)]} {confidence:.2f}"
+        (w, h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)
+        top = max(p1[1] - h - 4, 0)
+        cv2.rectangle(frame, (p1[0], top), (p1[0] + w, top + h + 4), color, -1, cv2.LINE_AA)
+        cv2.putText(frame, text, (p1[0], top + h + 1), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.6, (255, 255, 255), 1, cv2.LINE_AA)
+    return frame
+
+
+def multipart_part(jpeg):
+    """Build one multipart part with a single copy of the JPEG buffer.
+
+    WSGI servers only accept bytes, so a reusable bytearray/memoryview can't
+    be yielded; with turbojpeg's reused output buffer this join is the only
+    per-frame allocation. One joined part per frame also keeps it to one
+    chunked write instead of three (werkzeug sends each yield as its own chunk).
+    """
+    return b''.join((PART_HEADER, jpeg, PART_TRAILER))
+
+
+@functools.lru_cache(maxsize=1)
+def reconnecting_part():
+    """Multipart part showing a "camera reconnecting" placeholder (built once)"""
+    image = np.zeros((360, 640, 3), dtype=np.uint8)
+    cv2.putText(image, "Camera reconnecting...", (110, 190), cv2.FONT_HERSHEY_SIMPLEX,
+                1.0, (255, 255, 255), 2, cv2.LINE_AA)
+    _, buffer = cv2.imencode('.jpg', image)
+    return multipart_part(buffer)
@@ -0,0 +1,195 @@
+import logging
+import os
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Alert priorities (lower is more urgent)
+PRIORITY_CRITICAL = 1
+PRIORITY_WARNING = 2
+PRIORITY_INFO = 3
+
+DEFAULT_THRESHOLD = 0.3
+
+# Each profile maps label -> (confidence threshold, priority). Only these
+# classes are passed to the model, so NMS never sees anything else.
+# Labels listed under "quiet" are still detected and recorded but are not
+# eligible for spoken cautions.
+PROFILES = {
+    "street": {
+        "description": "Outdoor walking: traffic, crossings and street obstacles",
+        "classes": {
+            "person": (0.4, PRIORITY_WARNING),
+            "bicycle": (0.35, PRIORITY_CRITICAL),
+            "car": (0.35, PRIORITY_CRITICAL),
+            "motorcycle": (0.35, PRIORITY_CRITICAL),
+            "bus": (0.35, PRIORITY_CRITICAL),
+            "truck": (0.35, PRIORITY_CRITICAL),
+            "train": (0.4, PRIORITY_CRITICAL),
+            "traffic light": (0.3, PRIORITY_WARNING),
+            "stop sign": (0.3, PRIORITY_WARNING),
+            "fire hydrant": (0.35, PRIORITY_INFO),
+            "parking meter": (0.35, PRIORITY_INFO),
+            "bench": (0.4, PRIORITY_INFO),
+            "potted plant": (0.4, PRIORITY_INFO),
+            "dog": (0.4, PRIORITY_WARNING),
+            "horse": (0.4, PRIORITY_WARNING),
+            "cow": (0.4, PRIORITY_WARNING),
+            "skateboard": (0.4, PRIORITY_WARNING),
+            "umbrella": (0.45, PRIORITY_INFO),
+        },
+        "quiet": ["umbrella"],
+    },
+    "indoor": {
+        "description": "Home and office: furniture, doors and sharp objects",
+        "classes": {
+            "person": (0.4, PRIORITY_WARNING),
+            "chair": (0.35, PRIORITY_WARNING),
+            "couch": (0.35, PRIORITY_WARNING),
+            "bed": (0.4, PRIORITY_INFO),
+            "dining table": (0.35, PRIORITY_WARNING),
+            "potted plant": (0.35, PRIORITY_WARNING),
+            "toilet": (0.4, PRIORITY_INFO),
+            "sink": (0.4, PRIORITY_INFO),
+            "refrigerator": (0.4, PRIORITY_INFO),
+            "oven": (0.4, PRIORITY_WARNING),
+            "microwave": (0.45, PRIORITY_INFO),
+            "tv": (0.45, PRIORITY_INFO),
+            "laptop": (0.45, PRIORITY_INFO),
+            "knife": (0.35, PRIORITY_CRITICAL),
+            "scissors": (0.35, PRIORITY_CRITICAL),
+            "wine glass": (0.4, PRIORITY_WARNING),
+            "vase": (0.4, PRIORITY_WARNING),
+            "cat": (0.4, PRIORITY_WARNING),
+            "dog": (0.4, PRIORITY_WARNING),
+            "suitcase": (0.4, PRIORITY_WARNING),
+            "backpack": (0.45, PRIORITY_INFO),
+        },
+        "quiet": ["microwave", "tv", "laptop"],
+    },
+    "transit": {
+        "description": "Stations and stops: vehicles, crowds and luggage",
+        "classes": {
+            "person": (0.4, PRIORITY_WARNING),
+            "bus": (0.35, PRIORITY_CRITICAL),
+            "train": (0.35, PRIORITY_CRITICAL),
+            "car": (0.35, PRIORITY_CRITICAL),
+            "truck": (0.35, PRIORITY_CRITICAL),
+            "bicycle": (0.35, PRIORITY_WARNING),
+            "motorcycle": (0.35, PRIORITY_CRITICAL),
+            "traffic light": (0.3, PRIORITY_WARNING),
+            "stop sign": (0.3, PRIORITY_WARNING),
+            "bench": (0.4, PRIORITY_INFO),
+            "suitcase": (0.4, PRIORITY_WARNING),
+            "backpack": (0.45, PRIORITY_INFO),
+            "handbag": (0.45, PRIORITY_INFO),
+        },
+        "quiet": ["backpack", "handbag"],
+    },
+    # Every class the model knows, with the original flat threshold
+    "all": {
+        "description": "All model classes (no filtering)",
+        "classes": None,
+        "quiet": [],
+    },
+}
+
+# 'all' keeps the original behaviour until the app can switch profiles itself;
+# a narrower default would silently drop obstacles for users it doesn't fit
+DEFAULT_PROFILE = os.getenv('HAZARD_PROFILE', 'all').strip().lower()
+if DEFAULT_PROFILE not in PROFILES:
+    logger.warning(f"Unknown HAZARD_PROFILE '{DEFAULT_PROFILE}', using 'all'. Options: {', '.join(PROFILES)}")
+    DEFAULT_PROFILE = 'all'
+
+_session_profiles = {}
+_lock = threading.Lock()
+
+
+def list_profiles():
+    return {
+        name: {
+            "description": profile["description"],
+            "classes": sorted(profile["classes"]) if profile["classes"] is not None else "all",
+            "quiet": profile["quiet"],
+        }
+        for name, profile in PROFILES.items()
+    }
+
+
+def get_session_profile(session_id):
+    with _lock:
+        return _session_profiles.get(session_id, DEFAULT_PROFILE)
+
+
+def set_session_profile(session_id, name):
+    """Switch the active profile for a session; raises KeyError if unknown"""
+    if name not in PROFILES:
+        raise KeyError(name)
+    with _lock:
+        _session_profiles[session_id] = name
+
+
+def forget_session_profile(session_id):
+    with _lock:
+        _session_profiles.pop(session_id, None)
+
+
+class ResolvedProfile:
+    """A profile bound to a model's class-name table"""
+
+    def __init__(self, name, names):
+        profile = PROFILES[name]
+        self.name = name
+        self.names = names
+        self.quiet = set(profile["quiet"])
+        classes = profile["classes"]
+        if classes is None:
+            classes = {label.lower(): (DEFAULT_THRESHOLD, PRIORITY_INFO) for label in names.values()}
+
+        ids_by_label = {label.lower(): class_id for class_id, label in names.items()}
+        self.thresholds = {}
+        self.priorities = {}
+        for label, (threshold, priority) in classes.items():
+            if label in ids_by_label:
+                self.thresholds[ids_by_label[label]] = threshold
+                self.priorities[label] = priority
+
+        # None means "don't filter" to the model
+        self.class_ids = None if profile["classes"] is None else sorted(self.thresholds)
+        self.min_threshold = min(self.thresholds.values(), default=DEFAULT_THRESHOLD)
+
+        # Lookup table indexed by class ID; classes outside the profile never pass
+        self.threshold_table = np.full(max(names, default=-1) + 1, np.inf, dtype=np.float32)
+        for class_id, threshold in self.thresholds.items():
+            self.threshold_table[class_id] = threshold
+
+    def accept_mask(self, class_ids, confidences):
+        """Vectorised per-class threshold check for one frame's detections"""
+        return confidences >= self.threshold_table[class_ids]
+
+    def priority(self, label):
+        return self.priorities.get(label, PRIORITY_INFO)
+
+    def can_speak(self, label):
+        return label in self.priorities and label not in self.quiet
+
+    def sort_labels(self, labels):
+        return sorted(labels, key=self.priority)
+
+
+_resolved = {}
+
+
+def resolve_profile(name, names):
+    """Return a cached ResolvedProfile for this profile and class table"""
+    # Keyed by table identity so a shadow model doesn't evict the live one
+    key = (name, id(names))
+    with _lock:
+        resolved = _resolved.get(key)
+        if resolved is None or resolved.names is not names:
+            if len(_resolved) >= 4 * len(PROFILES):
+                _resolved.clear()
+            resolved = ResolvedProfile(name, names)
+            _resolved[key] = resolved
+        return resolved
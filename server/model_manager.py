@@ -0,0 +1,364 @@
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+import numpy as np
+from ultralytics import YOLO
+from hazard_profiles import resolve_profile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = os.getenv('MODEL_WEIGHTS', 'yolov5su.pt')
+# Weights the admin API may load: official names from this allowlist, or
+# files already present in MODELS_DIR. Anything else (URLs, paths) is refused,
+# since loading a .pt file unpickles it.
+ALLOWED_WEIGHTS = [w.strip() for w in os.getenv(
+    'MODEL_ALLOWLIST', 'yolov5nu.pt,yolov5su.pt,yolov5mu.pt,yolov8n.pt,yolov8s.pt,yolov8m.pt'
+).split(',') if w.strip()]
+MODELS_DIR = os.getenv('MODELS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+WEIGHTS_NAME = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]*\.(pt|onnx|tflite|torchscript|engine)$')
+WARMUP_RUNS = 3
+WARMUP_SHAPE = (720, 1280, 3)
+# After a swap, an inference error within this many frames reverts the swap
+PROBATION_FRAMES = 30
+LATENCY_WINDOW = 500  # latency samples kept per model for percentiles
+AGREEMENT_IOU = 0.5
+
+STATE_IDLE = 'idle'
+STATE_LOADING = 'loading'
+STATE_FAILED = 'failed'
+
+
+def resolve_weights(name):
+    """Map an admin-supplied weights name to something safe to load.
+
+    Raises ValueError for URLs, paths and names that are neither allowlisted
+    nor a file in MODELS_DIR.
+    """
+    if not isinstance(name, str) or not WEIGHTS_NAME.match(name) or '..' in name:
+        raise ValueError(f"Invalid weights name: {name!r} (expected a bare file name)")
+    if name in ALLOWED_WEIGHTS:
+        return name
+    path = os.path.join(MODELS_DIR, name)
+    if os.path.isfile(path):
+        return path
+    raise ValueError(f"{name} is not in MODEL_ALLOWLIST or {MODELS_DIR}")
+
+
+def load_model(weights):
+    """Load weights and run a few dummy frames so the first real frame is fast"""
+    candidate = YOLO(weights)
+    dummy = np.zeros(WARMUP_SHAPE, dtype=np.uint8)
+    for _ in range(WARMUP_RUNS):
+        candidate(dummy, verbose=False)
+    if not candidate.names:
+        raise ValueError(f"{weights} has no class names")
+    return candidate
+
+
+def _box_iou(a, b):
+    """Pairwise IoU between two (N, 4) and (M, 4) xyxy arrays"""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def detection_agreement(labels_a, boxes_a, labels_b, boxes_b, iou_threshold=AGREEMENT_IOU):
+    """Fraction of detections matched one-to-one by label and IoU (1.0 if both empty)"""
+    if len(labels_a) == 0 and len(labels_b) == 0:
+        return 1.0
+    if len(labels_a) == 0 or len(labels_b) == 0:
+        return 0.0
+    iou = _box_iou(np.asarray(boxes_a), np.asarray(boxes_b))
+    same_label = np.asarray(labels_a)[:, None] == np.asarray(labels_b)[None, :]
+    iou = np.where(same_label, iou, 0.0)
+    matched = 0
+    # Greedy matching, best pair first
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        matched += 1
+        iou[i, :] = 0.0
+        iou[:, j] = 0.0
+    return matched / max(len(labels_a), len(labels_b))
+
+
+def _latency_summary(samples):
+    if not samples:
+        return None
+    values = np.fromiter(samples, dtype=np.float64) * 1000
+    return {
+        "samples": len(values),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+    }
+
+
+def detect(model, frame, profile_name):
+    """Run one frame through a model with a hazard profile.
+
+    Returns (labels, boxes, latency_seconds) for detections above the
+    profile's per-class thresholds.
+    """
+    profile = resolve_profile(profile_name, model.names)
+    start = time.perf_counter()
+    results = model(frame, classes=profile.class_ids, conf=profile.min_threshold, verbose=False)
+    latency = time.perf_counter() - start
+    boxes = results[0].boxes
+    if not len(boxes):
+        return [], np.zeros((0, 4), dtype=np.float32), latency
+    class_ids = boxes.cls.cpu().numpy().astype(np.intp)
+    keep = profile.accept_mask(class_ids, boxes.conf.cpu().numpy())
+    labels = [model.names[int(c)].lower() for c in class_ids[keep]]
+    return labels, boxes.xyxy.cpu().numpy()[keep], latency
+
+
+class ShadowRun:
+    """A candidate model compared against the live one on sampled frames"""
+
+    def __init__(self, weights, model, sample_rate):
+        self.weights = weights
+        self.model = model
+        self.sample_rate = sample_rate
+        self.started = time.time()
+        self.primary_latency = deque(maxlen=LATENCY_WINDOW)
+        self.candidate_latency = deque(maxlen=LATENCY_WINDOW)
+        self.agreement_total = 0.0
+        self.compared = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        # Held while the worker runs the candidate; ultralytics predictors
+        # aren't safe to call from two threads at once
+        self.busy = threading.Lock()
+
+    def stats(self):
+        return {
+            "weights": self.weights,
+            "sample_rate": self.sample_rate,
+            "running_for": round(time.time() - self.started, 1),
+            "frames_compared": self.compared,
+            "frames_dropped": self.dropped,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "mean_agreement": round(self.agreement_total / self.compared, 4) if self.compared else None,
+            "latency": {
+                "current": _latency_summary(self.primary_latency),
+                "candidate": _latency_summary(self.candidate_latency),
+            },
+        }
+
+
+class ModelManager:
+    """Owns the live model and swaps or shadow-tests replacements.
+
+    Readers call current() once per frame; swaps replace that reference
+    under a lock, so a frame always runs start to finish on one model.
+    """
+
+    def __init__(self, on_names_change=None):
+        # Called (outside the lock) when the live model's class table changes,
+        # since stored class IDs no longer map to the same labels
+        self.on_names_change = on_names_change
+        self._model = None
+        self._previous = None
+        self.weights = None
+        self.previous_weights = None
+        self.state = STATE_IDLE
+        self.pending = None
+        self.last_error = None
+        self._probation = 0
+        self._shadow = None
+        self._shadow_queue = queue.Queue(maxsize=1)
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def current(self):
+        return self._model
+
+    def _install_live(self, model, weights):
+        """Make model live, keeping the old one for rollback. Caller holds _lock.
+
+        Returns True if the class table changed.
+        """
+        old = self._model
+        self._previous, self.previous_weights = old, self.weights
+        self._model, self.weights = model, weights
+        self._probation = PROBATION_FRAMES
+        return old is None or dict(old.names) != dict(model.names)
+
+    def _names_changed(self):
+        if self.on_names_change:
+            try:
+                self.on_names_change()
+            except Exception as e:
+                logger.error(f"Error in on_names_change: {e}")
+
+    def load(self, weights):
+        """Load weights synchronously as the live model (used at startup)"""
+        self._model = load_model(weights)
+        self.weights = weights
+        return self._model
+
+    def _load_in_background(self, weights, install):
+        source = resolve_weights(weights)
+        with self._lock:
+            if self.state == STATE_LOADING:
+                raise RuntimeError(f"Already loading {self.pending}")
+            self.state = STATE_LOADING
+            self.pending = weights
+
+        def run():
+            try:
+                candidate = load_model(source)
+            except Exception as e:
+                # The live model was never touched, so there is nothing to undo
+                logger.error(f"Failed to load model {weights}: {e}")
+                with self._lock:
+                    self.state = STATE_FAILED
+                    self.last_error = f"{weights}: {e}"
+                    self.pending = None
+                return
+            with self._lock:
+                names_changed = install(candidate)
+                self.state = STATE_IDLE
+                self.pending = None
+                self.last_error = None
+            if names_changed:
+                self._names_changed()
+
+        threading.Thread(target=run, name='model-loader', daemon=True).start()
+
+    def swap_async(self, weights):
+        """Load, warm up and atomically install new weights as the live model"""
+        def install(candidate):
+            names_changed = self._install_live(candidate, weights)
+            logger.info(f"Swapped live model to {weights} (was {self.previous_weights})")
+            return names_changed
+        self._load_in_background(weights, install)
+
+    def rollback(self, reason=None, expected=None):
+        """Reinstate the previous model; returns False if there is none.
+
+        With expected set, only roll back if that model is still live.
+        """
+        with self._lock:
+            if self._previous is None or (expected is not None and self._model is not expected):
+                return False
+            failed, failed_model = self.weights, self._model
+            self._model, self._previous = self._previous, None
+            self.weights, self.previous_weights = self.previous_weights, None
+            self._probation = 0
+            if reason:
+                self.last_error = f"{failed}: {reason}"
+            names_changed = dict(failed_model.names) != dict(self._model.names)
+        logger.warning(f"Rolled back model {failed} -> {self.weights}" + (f": {reason}" if reason else ""))
+        if names_changed:
+            self._names_changed()
+        return True
+
+    def frame_done(self, model, error=None):
+        """Report a live inference result; errors during probation roll back"""
+        with self._lock:
+            if model is not self._model or self._probation <= 0:
+                return
+            if error is None:
+                self._probation -= 1
+                return
+        self.rollback(reason=f"inference error after swap: {error}", expected=model)
+
+    def start_shadow(self, weights, sample_rate):
+        """Load a candidate that runs on a sample of frames alongside the live model"""
+        def install(candidate):
+            self._shadow = ShadowRun(weights, candidate, sample_rate)
+            logger.info(f"Shadow testing {weights} on {sample_rate:.0%} of frames")
+            return False
+        self._load_in_background(weights, install)
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._shadow_loop, name='model-shadow', daemon=True)
+            self._worker.start()
+
+    def stop_shadow(self):
+        with self._lock:
+            shadow, self._shadow = self._shadow, None
+        if shadow is not None:
+            with shadow.busy:  # let an in-flight sample finish
+                pass
+        return shadow
+
+    def promote_shadow(self):
+        """Make the (already warm) shadow candidate the live model"""
+        with self._lock:
+            shadow, self._shadow = self._shadow, None
+        if shadow is None:
+            return None
+        # Wait out an in-flight sample so the stream and the shadow worker
+        # never call the same predictor concurrently
+        with shadow.busy, self._lock:
+            names_changed = self._install_live(shadow.model, shadow.weights)
+        logger.info(f"Promoted shadow model {shadow.weights} (was {self.previous_weights})")
+        if names_changed:
+            self._names_changed()
+        return shadow
+
+    def shadow_stats(self):
+        shadow = self._shadow
+        return shadow.stats() if shadow else None
+
+    def wants_shadow_sample(self):
+        shadow = self._shadow
+        return shadow is not None and random.random() < shadow.sample_rate
+
+    def submit_shadow(self, frame, profile_name, labels, boxes, latency):
+        """Queue a frame the live model already processed for comparison.
+
+        The caller passes its own copy of the frame. If the worker is still
+        busy with the previous sample, this one is dropped so the stream
+        never waits on the candidate.
+        """
+        shadow = self._shadow
+        if shadow is None:
+            return
+        try:
+            self._shadow_queue.put_nowait((shadow, frame, profile_name, labels, boxes, latency))
+        except queue.Full:
+            shadow.dropped += 1
+
+    def _shadow_loop(self):
+        while True:
+            shadow, frame, profile_name, labels, boxes, latency = self._shadow_queue.get()
+            try:
+                with shadow.busy:
+                    if shadow is not self._shadow:
+                        continue  # stopped, replaced or promoted while queued
+                    cand_labels, cand_boxes, cand_latency = detect(shadow.model, frame, profile_name)
+            except Exception as e:
+                shadow.errors += 1
+                shadow.last_error = str(e)
+                logger.error(f"Shadow model {shadow.weights} failed: {e}")
+                continue
+            shadow.primary_latency.append(latency)
+            shadow.candidate_latency.append(cand_latency)
+            shadow.agreement_total += detection_agreement(labels, boxes, cand_labels, cand_boxes)
+            shadow.compared += 1
+
+    def status(self):
+        return {
+            "weights": self.weights,
+            "previous_weights": self.previous_weights,
+            "loaded": self._model is not None,
+            "state": self.state,
+            "pending": self.pending,
+            "last_error": self.last_error,
+            "probation_frames": self._probation,
+            "shadow": self.shadow_stats(),
+        }